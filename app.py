@@ -13,16 +13,44 @@ from pydantic import BaseModel
 from typing import Optional, List
 import os
 import json
+import time
+import asyncio
 import hashlib
+import logging
 import random
-from datetime import datetime, timedelta
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
 import jwt
 
+from kpi_history import (
+    DIA, HORA, KPIHistory, consumption_rate, linear_trend, parse_duration,
+    rolling_average, stock_forecast, trend_direction
+)
+
+logger = logging.getLogger(__name__)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if KPI_SEED_DEMO_HISTORY:
+        try:
+            if await asyncio.to_thread(seed_demo_history, kpi_history):
+                logger.info("Histórico de KPIs de prueba cargado en %s", KPI_HISTORY_PATH)
+        except Exception:
+            logger.exception("Error cargando el histórico de KPIs de prueba")
+    snapshot_task = asyncio.create_task(kpi_snapshot_loop())
+    yield
+    snapshot_task.cancel()
+    try:
+        await snapshot_task
+    except asyncio.CancelledError:
+        pass
+
 # Configuración de la aplicación
 app = FastAPI(
     title="Constructora E2E Platform",
     description="Plataforma completa para gestión de constructora",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Middleware CORS
@@ -284,6 +312,15 @@ DEMO_EMPLOYEES = [
     }
 ]
 
+DEMO_FINANZAS = {
+    "ingresos": 150000,
+    "egresos": 120000
+}
+
+DEMO_PERSONAL = {
+    "rotacion": 5.0  # porcentaje anual
+}
+
 # Funciones de utilidad
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return hash_password(plain_password) == hashed_password
@@ -393,6 +430,89 @@ class ConstructionAI:
 # Instancia del chatbot IA
 ai_chatbot = ConstructionAI()
 
+# Histórico de KPIs (series temporales, ver kpi_history.py)
+KPI_HISTORY_PATH = os.getenv("KPI_HISTORY_PATH", "kpi_history.db")
+KPI_SEED_DEMO_HISTORY = os.getenv("KPI_SEED_DEMO_HISTORY", "false").lower() in ("1", "true", "yes")
+KPI_MIN_SNAPSHOT_INTERVAL = 60
+
+def read_snapshot_interval() -> int:
+    raw = os.getenv("KPI_SNAPSHOT_INTERVAL", str(HORA))
+    try:
+        interval = int(raw)
+    except ValueError:
+        interval = None
+    if interval is None or interval < KPI_MIN_SNAPSHOT_INTERVAL:
+        logger.warning(
+            "KPI_SNAPSHOT_INTERVAL=%r inválido (mínimo %ss), se usa %ss",
+            raw, KPI_MIN_SNAPSHOT_INTERVAL, HORA
+        )
+        return HORA
+    return interval
+
+KPI_SNAPSHOT_INTERVAL = read_snapshot_interval()
+
+def current_kpi_values() -> dict:
+    """Valores actuales de los KPIs que se guardan en cada snapshot"""
+    values = {
+        "finanzas.ingresos": DEMO_FINANZAS["ingresos"],
+        "finanzas.egresos": DEMO_FINANZAS["egresos"],
+        "finanzas.utilidad": DEMO_FINANZAS["ingresos"] - DEMO_FINANZAS["egresos"],
+        "obras.en_progreso": len([p for p in DEMO_PROJECTS if p["estado"] == "EN_PROGRESO"]),
+        "personal.activos": len([e for e in DEMO_EMPLOYEES if e["estado"] == "ACTIVO"]),
+        "personal.rotacion": DEMO_PERSONAL["rotacion"]
+    }
+    for item in DEMO_STOCK:
+        values[f"stock.{item['sku']}"] = item["stock"]
+    return values
+
+def snapshot_slot(now: float) -> int:
+    # Alinear al intervalo: todos los workers escriben el mismo slot y solo cuenta uno
+    return int(now) // KPI_SNAPSHOT_INTERVAL * KPI_SNAPSHOT_INTERVAL
+
+def snapshot_kpis(history: KPIHistory, now: Optional[float] = None):
+    history.record(current_kpi_values(), snapshot_slot(time.time() if now is None else now))
+
+def seed_demo_history(history: KPIHistory, days: int = 365, now: Optional[float] = None) -> bool:
+    """Carga un año de histórico horario de prueba si el almacén está vacío"""
+    now = time.time() if now is None else now
+    # El histórico termina una hora antes del slot del snapshot exacto final
+    slot = snapshot_slot(now)
+    rng = random.Random(42)
+    current = current_kpi_values()
+    consumo = {f"stock.{item['sku']}": item["minimo"] / 20 for item in DEMO_STOCK}
+    hours = days * 24
+    samples = []
+    for h in range(hours, 0, -1):
+        ts = slot - h * HORA
+        ramp = 0.8 + 0.2 * (1 - h / hours)
+        ingresos = current["finanzas.ingresos"] * ramp * (1 + rng.uniform(-0.02, 0.02))
+        egresos = current["finanzas.egresos"] * ramp * (1 + rng.uniform(-0.02, 0.02))
+        samples.append(("finanzas.ingresos", ts, ingresos))
+        samples.append(("finanzas.egresos", ts, egresos))
+        samples.append(("finanzas.utilidad", ts, ingresos - egresos))
+        samples.append(("personal.rotacion", ts, current["personal.rotacion"] * (1 + rng.uniform(-0.02, 0.02))))
+        for metric in ("obras.en_progreso", "personal.activos"):
+            samples.append((metric, ts, current[metric]))
+        for metric, rate in consumo.items():
+            # Diente de sierra: consumo diario con reposición cada 30 días
+            samples.append((metric, ts, current[metric] + rate * ((h / 24) % 30)))
+    if not history.bulk_load(samples):
+        return False
+    # El histórico sembrado termina en el valor exacto actual
+    snapshot_kpis(history, slot)
+    return True
+
+async def kpi_snapshot_loop():
+    while True:
+        try:
+            # SQLite bloquea mientras otro worker escribe: fuera del event loop
+            await asyncio.to_thread(snapshot_kpis, kpi_history)
+        except Exception:
+            logger.exception("Error guardando snapshot de KPIs")
+        await asyncio.sleep(KPI_SNAPSHOT_INTERVAL - time.time() % KPI_SNAPSHOT_INTERVAL)
+
+kpi_history = KPIHistory(KPI_HISTORY_PATH)
+
 # Endpoints
 @app.get("/")
 async def root():
@@ -412,6 +532,7 @@ async def api_info():
             "/kpi/obras",
             "/kpi/finanzas", 
             "/kpi/personal",
+            "/kpi/history",
             "/proyectos",
             "/proyectos/{id}/hitos",
             "/stock",
@@ -476,9 +597,9 @@ async def get_kpi_finanzas(current_user: dict = Depends(get_current_user)):
         raise HTTPException(status_code=403, detail="Access denied")
     
     total_presupuesto = sum(p["presupuesto"] for p in DEMO_PROJECTS)
-    ingresos = 150000
-    egresos = 120000
-    utilidad = ingresos - egresos
+    ingresos = DEMO_FINANZAS["ingresos"]
+    egresos = DEMO_FINANZAS["egresos"]
+    utilidad = round(ingresos - egresos, 2)
     
     return {
         "ingresos": ingresos,
@@ -497,16 +618,87 @@ async def get_kpi_personal(current_user: dict = Depends(get_current_user)):
     total_empleados = len(DEMO_EMPLOYEES)
     empleados_activos = len([e for e in DEMO_EMPLOYEES if e["estado"] == "ACTIVO"])
     salario_promedio = sum(e["salario"] for e in DEMO_EMPLOYEES) / total_empleados if total_empleados > 0 else 0
+    rotacion = DEMO_PERSONAL["rotacion"]
     
     return {
         "total_empleados": total_empleados,
         "activos": empleados_activos,
         "licencias": total_empleados - empleados_activos,
-        "rotacion": "5%",
+        "rotacion": f"{rotacion:g}%",
         "salario_promedio": round(salario_promedio, 2),
         "antiguedad_promedio": round(sum(e["antiguedad"] for e in DEMO_EMPLOYEES) / total_empleados, 1)
     }
 
+@app.get("/kpi/history")
+def get_kpi_history(
+    metric: str,
+    window: str = "30d",
+    rolling: str = "7d",
+    current_user: dict = Depends(get_current_user)
+):
+    """Histórico de una métrica con promedio móvil, tendencia y pronóstico de stock
+
+    Es síncrono para que FastAPI lo ejecute en el threadpool: las consultas a
+    SQLite pueden esperar el lock de escritura de otro worker.
+    """
+    allowed_roles = ["ADMIN", "LOGISTICA"] if metric.startswith("stock.") else ["ADMIN", "EJECUTIVO"]
+    if current_user["role"] not in allowed_roles:
+        raise HTTPException(status_code=403, detail="Access denied")
+    
+    try:
+        window_seconds = parse_duration(window)
+        rolling_seconds = parse_duration(rolling)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    ultimo = kpi_history.latest(metric)
+    if ultimo is None:
+        raise HTTPException(status_code=404, detail=f"Unknown metric. Available: {', '.join(kpi_history.metrics())}")
+    
+    now = time.time()
+    width, ts, values = kpi_history.query(metric, window_seconds, now)
+    rolling_buckets = max(1, round(rolling_seconds / width))
+    promedio_movil = rolling_average(values, rolling_buckets)
+    pendiente = linear_trend(ts, values)
+    unidad = "hora" if width == HORA else "dia"
+    
+    response = {
+        "metric": metric,
+        "window": window,
+        "resolucion": unidad,
+        "promedio_movil": {"ventana": rolling, "buckets": rolling_buckets, "unidad": unidad},
+        "puntos": [
+            {
+                "timestamp": datetime.fromtimestamp(t, tz=timezone.utc).isoformat(),
+                "valor": round(v, 2),
+                "promedio_movil": round(m, 2)
+            }
+            for t, v, m in zip(ts, values, promedio_movil)
+        ],
+        "resumen": {
+            "ultimo": round(ultimo, 2),
+            "minimo": round(min(values), 2) if values else None,
+            "maximo": round(max(values), 2) if values else None,
+            "promedio": round(sum(values) / len(values), 2) if values else None
+        },
+        "tendencia": {
+            "pendiente_diaria": round(pendiente, 4) if pendiente is not None else None,
+            "direccion": trend_direction(pendiente, ts, values)
+        }
+    }
+    
+    if metric.startswith("stock."):
+        item = next((i for i in DEMO_STOCK if f"stock.{i['sku']}" == metric), None)
+        if item is not None:
+            pronostico = stock_forecast(ultimo, item["minimo"], consumption_rate(ts, values))
+            dias = pronostico["dias_hasta_agotamiento"]
+            pronostico["fecha_agotamiento"] = (
+                datetime.fromtimestamp(now + dias * DIA, tz=timezone.utc).isoformat() if dias is not None else None
+            )
+            response["pronostico"] = pronostico
+    
+    return response
+
 @app.get("/proyectos")
 async def get_proyectos(current_user: dict = Depends(get_current_user)):
     if current_user["role"] == "CLIENTE":
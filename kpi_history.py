@@ -0,0 +1,214 @@
+"""
+Histórico de KPIs - series temporales en SQLite
+Los snapshots se agregan en buckets horarios y diarios dentro de un archivo
+SQLite que comparten todos los workers de gunicorn del mismo host.
+Los cálculos usan la librería estándar (sin numpy): una consulta devuelve a
+lo sumo 7 * 24 buckets horarios o 366 diarios, así que recorrerlos en Python
+cuesta menos de un milisegundo.
+"""
+
+import os
+import re
+import sqlite3
+import threading
+from array import array
+from itertools import accumulate
+from typing import Dict, Iterable, List, Optional, Tuple
+
+HORA = 3600
+DIA = 24 * HORA
+MAX_WINDOW_DAYS = 366
+# Hasta esta ventana se responde con buckets horarios; por encima, diarios
+HOURLY_MAX_DAYS = 7
+BUCKET_WIDTHS = (HORA, DIA)
+# Las muestras crudas solo se usan para deduplicar snapshots entre workers;
+# siempre se conserva la última de cada métrica
+RAW_RETENTION = 2 * DIA
+TREND_MIN_POINTS = 4
+# Cambio relativo sobre la ventana por debajo del cual la tendencia es "estable"
+TREND_STABLE_THRESHOLD = 0.01
+# Subida relativa entre buckets a partir de la cual se considera una reposición
+RESTOCK_THRESHOLD = 0.05
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS kpi_samples (
+    metric TEXT NOT NULL,
+    ts INTEGER NOT NULL,
+    value REAL NOT NULL,
+    PRIMARY KEY (metric, ts)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS kpi_buckets (
+    metric TEXT NOT NULL,
+    width INTEGER NOT NULL,
+    start INTEGER NOT NULL,
+    total REAL NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (metric, width, start)
+) WITHOUT ROWID;
+"""
+
+class KPIHistory:
+    """Series temporales append-only de KPIs, agregadas en buckets horarios y diarios"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+
+    def _db(self) -> sqlite3.Connection:
+        # Una conexión por proceso (worker de gunicorn) y por hilo
+        local = self._local
+        if getattr(local, "pid", None) != os.getpid():
+            local.conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            local.conn.execute("PRAGMA journal_mode=WAL")
+            local.conn.executescript(SCHEMA)
+            local.pid = os.getpid()
+        return local.conn
+
+    def record(self, values: Dict[str, float], ts: float):
+        """Guarda un snapshot; repetir el mismo timestamp (otro worker) no tiene efecto"""
+        ts = int(ts)
+        db = self._db()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            for metric, value in values.items():
+                last = db.execute("SELECT max(ts) FROM kpi_samples WHERE metric = ?", (metric,)).fetchone()[0]
+                if last is not None and ts < last:
+                    raise ValueError(f"La serie {metric} es append-only: timestamp anterior a la última muestra")
+                inserted = db.execute(
+                    "INSERT OR IGNORE INTO kpi_samples (metric, ts, value) VALUES (?, ?, ?)",
+                    (metric, ts, float(value))
+                ).rowcount
+                if not inserted:
+                    continue
+                for width in BUCKET_WIDTHS:
+                    db.execute(
+                        "INSERT INTO kpi_buckets (metric, width, start, total, count) VALUES (?, ?, ?, ?, 1) "
+                        "ON CONFLICT (metric, width, start) DO UPDATE SET total = total + excluded.total, count = count + 1",
+                        (metric, width, ts // width * width, float(value))
+                    )
+            self._prune(db, ts - RAW_RETENTION)
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+
+    def bulk_load(self, samples: Iterable[Tuple[str, int, float]]) -> bool:
+        """Carga un histórico completo de una vez; solo si el almacén está vacío"""
+        db = self._db()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            if db.execute("SELECT 1 FROM kpi_buckets LIMIT 1").fetchone():
+                db.execute("ROLLBACK")
+                return False
+            db.executemany("INSERT INTO kpi_samples (metric, ts, value) VALUES (?, ?, ?)", samples)
+            for width in BUCKET_WIDTHS:
+                db.execute(
+                    "INSERT INTO kpi_buckets (metric, width, start, total, count) "
+                    "SELECT metric, ?, ts / ? * ?, sum(value), count(*) FROM kpi_samples GROUP BY metric, ts / ?",
+                    (width, width, width, width)
+                )
+            last = db.execute("SELECT max(ts) FROM kpi_samples").fetchone()[0]
+            if last is not None:
+                self._prune(db, last - RAW_RETENTION)
+            db.execute("COMMIT")
+            return True
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+
+    @staticmethod
+    def _prune(db: sqlite3.Connection, cutoff: int):
+        db.execute(
+            "DELETE FROM kpi_samples WHERE ts < ? AND ts < "
+            "(SELECT max(ts) FROM kpi_samples AS s WHERE s.metric = kpi_samples.metric)",
+            (cutoff,)
+        )
+
+    def latest(self, metric: str) -> Optional[float]:
+        row = self._db().execute(
+            "SELECT value FROM kpi_samples WHERE metric = ? ORDER BY ts DESC LIMIT 1", (metric,)
+        ).fetchone()
+        return None if row is None else row[0]
+
+    def metrics(self) -> List[str]:
+        rows = self._db().execute("SELECT DISTINCT metric FROM kpi_samples")
+        return sorted(row[0] for row in rows)
+
+    def query(self, metric: str, window_seconds: int, now: float):
+        """Buckets que empiezan dentro de la ventana: (ancho, timestamps, promedios)"""
+        width = HORA if window_seconds <= HOURLY_MAX_DAYS * DIA else DIA
+        rows = self._db().execute(
+            "SELECT start, total / count FROM kpi_buckets WHERE metric = ? AND width = ? AND start >= ? ORDER BY start",
+            (metric, width, now - window_seconds)
+        ).fetchall()
+        return width, array("q", (r[0] for r in rows)), array("d", (r[1] for r in rows))
+
+def parse_duration(text: str, max_days: int = MAX_WINDOW_DAYS) -> int:
+    """Convierte '24h' o '30d' a segundos"""
+    match = re.fullmatch(r"(\d+)([hd])", text.strip().lower())
+    if not match:
+        raise ValueError("Invalid duration, use e.g. 24h, 7d, 30d, 365d")
+    seconds = int(match.group(1)) * (HORA if match.group(2) == "h" else DIA)
+    if seconds <= 0 or seconds > max_days * DIA:
+        raise ValueError(f"Duration must be between 1h and {max_days}d")
+    return seconds
+
+def rolling_average(values, size: int) -> List[float]:
+    """Promedio móvil con sumas acumuladas: O(n) sin importar el tamaño de la ventana"""
+    sums = [0.0, *accumulate(values)]
+    return [
+        (sums[i + 1] - sums[max(0, i + 1 - size)]) / min(i + 1, size)
+        for i in range(len(values))
+    ]
+
+def linear_trend(ts, values) -> Optional[float]:
+    """Pendiente por día de la recta de mínimos cuadrados"""
+    n = len(values)
+    if n < TREND_MIN_POINTS:
+        return None
+    xs = [(t - ts[0]) / DIA for t in ts]
+    mean_x = sum(xs) / n
+    mean_y = sum(values) / n
+    var_x = sum((x - mean_x) ** 2 for x in xs)
+    if var_x == 0:
+        return None
+    cov = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, values))
+    return cov / var_x
+
+def trend_direction(slope: Optional[float], ts, values) -> str:
+    if slope is None:
+        return "sin_datos"
+    span_days = (ts[-1] - ts[0]) / DIA
+    mean = abs(sum(values) / len(values))
+    cambio = abs(slope * span_days)
+    if cambio == 0 or (mean > 0 and cambio / mean < TREND_STABLE_THRESHOLD):
+        return "estable"
+    return "alza" if slope > 0 else "baja"
+
+def consumption_rate(ts, values) -> Optional[float]:
+    """Consumo diario: caída neta entre reposiciones / días de esos tramos
+
+    Una reposición es una subida mayor a RESTOCK_THRESHOLD; las oscilaciones
+    menores quedan dentro del tramo y se compensan en la caída neta.
+    """
+    consumido = 0.0
+    segundos = 0
+    inicio = 0
+    for i in range(1, len(values) + 1):
+        if i == len(values) or values[i] > values[i - 1] * (1 + RESTOCK_THRESHOLD):
+            consumido += values[inicio] - values[i - 1]
+            segundos += ts[i - 1] - ts[inicio]
+            inicio = i
+    if segundos == 0:
+        return None
+    return max(0.0, consumido / (segundos / DIA))
+
+def stock_forecast(current: float, minimo: float, consumo: Optional[float]) -> dict:
+    """Días hasta el mínimo y hasta agotar el stock al ritmo de consumo dado"""
+    if not consumo:
+        return {"consumo_diario": 0.0, "dias_hasta_minimo": None, "dias_hasta_agotamiento": None}
+    return {
+        "consumo_diario": round(consumo, 2),
+        "dias_hasta_minimo": round(max(0.0, (current - minimo) / consumo), 1),
+        "dias_hasta_agotamiento": round(max(0.0, current / consumo), 1)
+    }
@@ -0,0 +1,128 @@
+import time
+
+import pytest
+
+pytest.importorskip("fastapi")
+from fastapi.testclient import TestClient
+
+import app as app_module
+from kpi_history import DIA, HORA, KPIHistory
+
+@pytest.fixture
+def history(tmp_path, monkeypatch):
+    history = KPIHistory(str(tmp_path / "kpi.db"))
+    monkeypatch.setattr(app_module, "kpi_history", history)
+    return history
+
+@pytest.fixture
+def seeded(history, monkeypatch):
+    monkeypatch.setattr(app_module, "KPI_SEED_DEMO_HISTORY", True)
+    return history
+
+def login(client, email):
+    response = client.post("/auth/login", json={"email": email, "password": "password123"})
+    return {"Authorization": f"Bearer {response.json()['token']}"}
+
+@pytest.fixture
+def client(seeded):
+    with TestClient(app_module.app) as client:
+        yield client
+
+def test_history_roles(client):
+    ejecutivo = login(client, "ejecutivo@demo.com")
+    logistica = login(client, "logistica@demo.com")
+    assert client.get("/kpi/history?metric=stock.WF-001", headers=ejecutivo).status_code == 403
+    assert client.get("/kpi/history?metric=finanzas.ingresos", headers=logistica).status_code == 403
+    assert client.get("/kpi/history?metric=stock.WF-001", headers=logistica).status_code == 200
+    assert client.get("/kpi/history?metric=finanzas.ingresos", headers=ejecutivo).status_code == 200
+
+@pytest.mark.parametrize("query", ["window=2y", "window=400d", "rolling=7", "rolling=abc"])
+def test_history_bad_durations(client, query):
+    admin = login(client, "admin@demo.com")
+    response = client.get(f"/kpi/history?metric=finanzas.ingresos&{query}", headers=admin)
+    assert response.status_code == 400
+
+def test_history_unknown_metric(client):
+    admin = login(client, "admin@demo.com")
+    response = client.get("/kpi/history?metric=finanzas.nada", headers=admin)
+    assert response.status_code == 404
+    assert "finanzas.ingresos" in response.json()["detail"]
+
+def test_history_response_shape(client):
+    admin = login(client, "admin@demo.com")
+    body = client.get("/kpi/history?metric=finanzas.ingresos&window=30d&rolling=7d", headers=admin).json()
+    assert body["resolucion"] == "dia"
+    assert body["promedio_movil"] == {"ventana": "7d", "buckets": 7, "unidad": "dia"}
+    assert len(body["puntos"]) == 30
+    assert body["puntos"][-1]["timestamp"].endswith("+00:00")
+    assert body["resumen"]["ultimo"] == 150000
+    assert body["tendencia"]["direccion"] == "alza"
+    assert "pronostico" not in body
+
+    body = client.get("/kpi/history?metric=finanzas.ingresos&window=24h&rolling=12h", headers=admin).json()
+    assert body["resolucion"] == "hora"
+    assert body["promedio_movil"]["buckets"] == 12
+    assert len(body["puntos"]) == 24
+
+@pytest.mark.parametrize("window", ["7d", "30d", "365d"])
+def test_history_forecast_matches_seeded_rate(client, window):
+    logistica = login(client, "logistica@demo.com")
+    body = client.get(f"/kpi/history?metric=stock.WF-001&window={window}", headers=logistica).json()
+    pronostico = body["pronostico"]
+    # El seed consume minimo / 20 = 2.5 vigas por día
+    assert pronostico["consumo_diario"] == pytest.approx(2.5, rel=0.1)
+    assert pronostico["dias_hasta_agotamiento"] == pytest.approx(150 / 2.5, rel=0.1)
+    assert pronostico["fecha_agotamiento"].endswith("+00:00")
+
+def test_kpi_endpoints_keep_exact_values(client):
+    admin = login(client, "admin@demo.com")
+    finanzas = client.get("/kpi/finanzas", headers=admin).json()
+    assert (finanzas["ingresos"], finanzas["egresos"], finanzas["utilidad"]) == (150000, 120000, 30000)
+    assert client.get("/kpi/personal", headers=admin).json()["rotacion"] == "5%"
+
+@pytest.mark.parametrize("interval", [60, 600, HORA, 3 * HORA, DIA])
+def test_seed_then_startup_with_any_interval(seeded, monkeypatch, interval):
+    monkeypatch.setattr(app_module, "KPI_SNAPSHOT_INTERVAL", interval)
+    with TestClient(app_module.app):
+        pass
+    assert seeded.latest("stock.WF-001") == 150
+    assert seeded.latest("finanzas.ingresos") == 150000
+    assert not app_module.seed_demo_history(seeded)
+
+def test_seeded_utilidad_is_ingresos_minus_egresos(seeded):
+    now = time.time()
+    app_module.seed_demo_history(seeded, days=2, now=now)
+    _, _, ingresos = seeded.query("finanzas.ingresos", DIA, now)
+    _, _, egresos = seeded.query("finanzas.egresos", DIA, now)
+    _, _, utilidad = seeded.query("finanzas.utilidad", DIA, now)
+    assert list(utilidad) == pytest.approx([i - e for i, e in zip(ingresos, egresos)])
+
+@pytest.mark.parametrize("raw, expected", [
+    (None, HORA), ("120", 120), ("60", 60), ("59", HORA), ("0", HORA), ("abc", HORA), ("1.5", HORA)
+])
+def test_read_snapshot_interval(monkeypatch, raw, expected):
+    if raw is None:
+        monkeypatch.delenv("KPI_SNAPSHOT_INTERVAL", raising=False)
+    else:
+        monkeypatch.setenv("KPI_SNAPSHOT_INTERVAL", raw)
+    assert app_module.read_snapshot_interval() == expected
+
+def test_snapshot_kpis_aligns_to_interval(history, monkeypatch):
+    monkeypatch.setattr(app_module, "KPI_SNAPSHOT_INTERVAL", 600)
+    t0 = 1_700_000_000 // DIA * DIA
+    finanzas = dict(app_module.DEMO_FINANZAS)
+    monkeypatch.setattr(app_module, "DEMO_FINANZAS", finanzas)
+
+    finanzas["ingresos"] = 100
+    app_module.snapshot_kpis(history, t0 + 601)
+    # Otro worker en el mismo slot no pisa el snapshot
+    finanzas["ingresos"] = 200
+    app_module.snapshot_kpis(history, t0 + 1199)
+    assert history.latest("finanzas.ingresos") == 100
+
+    finanzas["ingresos"] = 300
+    app_module.snapshot_kpis(history, t0 + 1200)
+    assert history.latest("finanzas.ingresos") == 300
+    _, ts, values = history.query("finanzas.ingresos", DIA, t0 + HORA)
+    assert list(ts) == [t0]
+    assert list(values) == [200]
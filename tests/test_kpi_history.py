@@ -0,0 +1,126 @@
+import pytest
+
+from kpi_history import (
+    DIA, HORA, KPIHistory, consumption_rate, linear_trend, parse_duration,
+    rolling_average, stock_forecast, trend_direction
+)
+
+T0 = 1_700_000_000 // DIA * DIA
+
+def test_parse_duration():
+    assert parse_duration("24h") == 24 * HORA
+    assert parse_duration(" 30D ") == 30 * DIA
+    assert parse_duration("366d") == 366 * DIA
+
+@pytest.mark.parametrize("text", ["", "7", "7w", "-1d", "0h", "367d", "1.5d"])
+def test_parse_duration_invalid(text):
+    with pytest.raises(ValueError):
+        parse_duration(text)
+
+def test_rolling_average():
+    assert rolling_average([1, 2, 3, 4], 2) == [1, 1.5, 2.5, 3.5]
+    assert rolling_average([], 3) == []
+
+def test_rolling_average_window_larger_than_series():
+    assert rolling_average([2, 4, 6], 10) == [2, 3, 4]
+
+def test_linear_trend_slope_per_day():
+    ts = [T0 + i * DIA for i in range(5)]
+    assert linear_trend(ts, [10, 12, 14, 16, 18]) == pytest.approx(2.0)
+
+def test_linear_trend_needs_enough_points():
+    ts = [T0, T0 + HORA, T0 + 2 * HORA]
+    assert linear_trend(ts, [1, 2, 3]) is None
+
+def test_linear_trend_zero_variance():
+    assert linear_trend([T0] * 4, [1, 2, 3, 4]) is None
+
+def test_trend_direction():
+    ts = [T0 + i * DIA for i in range(10)]
+    assert trend_direction(None, ts, [1] * 10) == "sin_datos"
+    assert trend_direction(0.0, ts, [0] * 10) == "estable"
+    # 0.9 de cambio sobre un promedio de 100: por debajo del 1%
+    assert trend_direction(0.1, ts, [100] * 10) == "estable"
+    assert trend_direction(5.0, ts, [100] * 10) == "alza"
+    assert trend_direction(-5.0, ts, [100] * 10) == "baja"
+
+def test_consumption_rate_ignores_restocks():
+    ts = [T0 + i * DIA for i in range(6)]
+    # Consume 10 por día y repone a mitad de la ventana
+    assert consumption_rate(ts, [100, 90, 80, 150, 140, 130]) == pytest.approx(10.0)
+
+def test_consumption_rate_ignores_noise():
+    ts = [T0 + i * HORA for i in range(7 * 24)]
+    # Diente de sierra de 2.4 por día con ruido de +-1% entre buckets horarios
+    values = [
+        (150 + 2.4 * ((7 * 24 - i) / 24 % 5)) * (1 + 0.01 * (-1) ** i)
+        for i in range(7 * 24)
+    ]
+    assert consumption_rate(ts, values) == pytest.approx(2.4, rel=0.1)
+
+def test_consumption_rate_without_data():
+    assert consumption_rate([T0], [100]) is None
+    assert consumption_rate([T0, T0 + DIA], [100, 120]) is None
+    assert consumption_rate([T0, T0 + DIA], [100, 102]) == 0
+
+def test_stock_forecast():
+    assert stock_forecast(150, 50, 2.5) == {
+        "consumo_diario": 2.5,
+        "dias_hasta_minimo": 40.0,
+        "dias_hasta_agotamiento": 60.0
+    }
+    assert stock_forecast(40, 50, 10)["dias_hasta_minimo"] == 0.0
+
+def test_stock_forecast_without_consumption():
+    forecast = stock_forecast(150, 50, None)
+    assert forecast["dias_hasta_agotamiento"] is None
+    assert stock_forecast(150, 50, 0) == forecast
+
+@pytest.fixture
+def history(tmp_path):
+    return KPIHistory(str(tmp_path / "kpi.db"))
+
+def test_record_buckets_hourly_and_daily(history):
+    history.record({"m": 10}, T0)
+    history.record({"m": 20}, T0 + 60)
+    history.record({"m": 30}, T0 + HORA)
+    width, ts, values = history.query("m", DIA, T0 + HORA)
+    assert width == HORA
+    assert list(ts) == [T0, T0 + HORA]
+    assert list(values) == [15, 30]
+    width, ts, values = history.query("m", 30 * DIA, T0 + HORA)
+    assert width == DIA
+    assert list(values) == [20]
+    assert history.latest("m") == 30
+    assert history.metrics() == ["m"]
+
+def test_record_same_slot_is_ignored(history):
+    history.record({"m": 10}, T0)
+    history.record({"m": 99}, T0)
+    _, _, values = history.query("m", DIA, T0)
+    assert list(values) == [10]
+
+def test_record_is_append_only(history):
+    history.record({"m": 10}, T0 + HORA)
+    with pytest.raises(ValueError):
+        history.record({"m": 20}, T0)
+    assert history.latest("m") == 10
+
+def test_latest_and_metrics_survive_pruning(history):
+    history.record({"a": 1, "b": 2}, T0)
+    history.record({"a": 3}, T0 + 3 * DIA)
+    assert history.metrics() == ["a", "b"]
+    assert history.latest("b") == 2
+    assert history.latest("a") == 3
+
+def test_query_clips_to_window(history):
+    for i in range(5):
+        history.record({"m": i}, T0 + i * HORA)
+    _, ts, _ = history.query("m", 2 * HORA, T0 + 4 * HORA + 1800)
+    assert list(ts) == [T0 + 3 * HORA, T0 + 4 * HORA]
+
+def test_bulk_load_only_when_empty(history):
+    assert history.bulk_load([("m", T0, 1.0), ("m", T0 + HORA, 3.0)])
+    assert not history.bulk_load([("m", T0 + 2 * HORA, 5.0)])
+    _, _, values = history.query("m", 30 * DIA, T0 + HORA)
+    assert list(values) == [2.0]